@@ -90,6 +90,20 @@ class TransformRecorderWidget(ScriptedLoadableModuleWidget):
     self.thirdTransformSelector.setToolTip( "Pick the transform node to be updated." )
     transformFormLayout.addRow("Transform 3: ", self.thirdTransformSelector)
 
+    #
+    # Recording Policy Area
+    #
+    policyCollapsibleButton = ctk.ctkCollapsibleButton()
+    policyCollapsibleButton.text = "RECORDING POLICY"
+    policyCollapsibleButton.collapsed = True
+    self.layout.addWidget(policyCollapsibleButton)
+    policyFormLayout = qt.QFormLayout(policyCollapsibleButton)
+    policyFormLayout.addRow(qt.QLabel('Max. rate, decimation and change thresholds'))
+
+    self.firstPolicyWidgets = self.addRecordingPolicyRow(policyFormLayout, "Transform 1: ")
+    self.secondPolicyWidgets = self.addRecordingPolicyRow(policyFormLayout, "Transform 2: ")
+    self.thirdPolicyWidgets = self.addRecordingPolicyRow(policyFormLayout, "Transform 3: ")
+
     #
     # Recording Area
     #
@@ -135,6 +149,54 @@ class TransformRecorderWidget(ScriptedLoadableModuleWidget):
     # Add vertical spacer
     self.layout.addStretch(1)
 
+  def addRecordingPolicyRow(self, formLayout, label):
+
+    maxRateSpinBox = qt.QDoubleSpinBox()
+    maxRateSpinBox.setRange(0.0, 1000.0)
+    maxRateSpinBox.setDecimals(1)
+    maxRateSpinBox.setSuffix(" Hz")
+    maxRateSpinBox.setSpecialValueText("No rate limit")
+    maxRateSpinBox.setValue(0.0)
+    maxRateSpinBox.setToolTip("Maximum recording rate in Hz. 0 records every event.")
+
+    decimationSpinBox = qt.QSpinBox()
+    decimationSpinBox.setRange(1, 1000)
+    decimationSpinBox.setPrefix("1/")
+    decimationSpinBox.setValue(1)
+    decimationSpinBox.setToolTip("Record one of every N events of the observed transform.")
+
+    translationThresholdSpinBox = qt.QDoubleSpinBox()
+    translationThresholdSpinBox.setRange(0.0, 1000.0)
+    translationThresholdSpinBox.setDecimals(2)
+    translationThresholdSpinBox.setSuffix(" mm")
+    translationThresholdSpinBox.setValue(0.0)
+    translationThresholdSpinBox.setToolTip("Record if the translation changed more than this distance (mm) since the last recorded frame. 0 ignores translation. If both thresholds are 0, every frame is recorded.")
+
+    rotationThresholdSpinBox = qt.QDoubleSpinBox()
+    rotationThresholdSpinBox.setRange(0.0, 180.0)
+    rotationThresholdSpinBox.setDecimals(2)
+    rotationThresholdSpinBox.setSuffix(" deg")
+    rotationThresholdSpinBox.setValue(0.0)
+    rotationThresholdSpinBox.setToolTip("Record if the rotation changed more than this angle (degrees) since the last recorded frame. 0 ignores rotation. If both thresholds are 0, every frame is recorded.")
+
+    rowLayout = qt.QHBoxLayout()
+    rowLayout.addWidget(maxRateSpinBox)
+    rowLayout.addWidget(decimationSpinBox)
+    rowLayout.addWidget(translationThresholdSpinBox)
+    rowLayout.addWidget(rotationThresholdSpinBox)
+    formLayout.addRow(label, rowLayout)
+
+    return (maxRateSpinBox, decimationSpinBox, translationThresholdSpinBox, rotationThresholdSpinBox)
+
+  def updateRecordingPolicy(self, policy, policyWidgets):
+
+    maxRateSpinBox, decimationSpinBox, translationThresholdSpinBox, rotationThresholdSpinBox = policyWidgets
+    policy.maxRate = maxRateSpinBox.value
+    policy.decimation = decimationSpinBox.value
+    policy.translationThreshold = translationThresholdSpinBox.value
+    policy.rotationThreshold = rotationThresholdSpinBox.value
+    policy.resetPolicy()
+
   def onFirstTransform(self):
 
     self.logic.setFirstTransform(self.firstTransformSelector.currentNode())  
@@ -162,6 +224,11 @@ class TransformRecorderWidget(ScriptedLoadableModuleWidget):
     else: 
       self.logic.activeTransform = None
 
+    # Apply recording policies
+    self.updateRecordingPolicy(self.logic.firstTransform_policy, self.firstPolicyWidgets)
+    self.updateRecordingPolicy(self.logic.secondTransform_policy, self.secondPolicyWidgets)
+    self.updateRecordingPolicy(self.logic.thirdTransform_policy, self.thirdPolicyWidgets)
+
     # Add observer
     if self.logic.activeTransform is not None:
       self.logic.addUpdateObserver(self.logic.activeTransform)
@@ -171,8 +238,11 @@ class TransformRecorderWidget(ScriptedLoadableModuleWidget):
       self.recordButton.enabled = False
       self.stopButton.enabled = True
       self.firstTransformSelector.enabled = False
+      self.setRecordingPolicyEnabled(self.firstPolicyWidgets, False)
       self.secondTransformSelector.enabled = False
+      self.setRecordingPolicyEnabled(self.secondPolicyWidgets, False)
       self.thirdTransformSelector.enabled = False
+      self.setRecordingPolicyEnabled(self.thirdPolicyWidgets, False)
 
     else:
       self.recordingStatusTextLabel.setText('Failed. No active transform has been selected.')
@@ -188,8 +258,11 @@ class TransformRecorderWidget(ScriptedLoadableModuleWidget):
     self.recordButton.enabled = True
     self.recordingStatusTextLabel.setText('Recording finished.')
     self.firstTransformSelector.enabled = True
+    self.setRecordingPolicyEnabled(self.firstPolicyWidgets, True)
     self.secondTransformSelector.enabled = True
+    self.setRecordingPolicyEnabled(self.secondPolicyWidgets, True)
     self.thirdTransformSelector.enabled = True
+    self.setRecordingPolicyEnabled(self.thirdPolicyWidgets, True)
 
     # Save Data Stream to File
     if self.logic.recordToMhaFile_flag:
@@ -200,6 +273,12 @@ class TransformRecorderWidget(ScriptedLoadableModuleWidget):
     self.logic.resetScene()
     
 
+  def setRecordingPolicyEnabled(self, policyWidgets, enabled):
+
+    for policyWidget in policyWidgets:
+      policyWidget.enabled = enabled
+
+
   def onRecordDataStreamToMhaFileChecked(self, checked):
 
     if checked:      
@@ -228,7 +307,9 @@ class TransformRecorderLogic(ScriptedLoadableModuleLogic):
 
     # Recording Data Stream To File/table
     self.recordToCsvFile_flag = False
-    self.timeStamp = list()
+    self.firstTransform_timeStamps = list()
+    self.secondTransform_timeStamps = list()
+    self.thirdTransform_timeStamps = list()
     self.firstTransform_matrices = list()
     self.secondTransform_matrices = list()
     self.thirdTransform_matrices = list()
@@ -242,6 +323,11 @@ class TransformRecorderLogic(ScriptedLoadableModuleLogic):
     self.secondTransform_name = ' '
     self.thirdTransform_name = ' '
 
+    # Recording policies (max. rate, decimation and change threshold of each transform stream)
+    self.firstTransform_policy = RecordingPolicy()
+    self.secondTransform_policy = RecordingPolicy()
+    self.thirdTransform_policy = RecordingPolicy()
+
 
   def resetScene(self):
 
@@ -255,7 +341,15 @@ class TransformRecorderLogic(ScriptedLoadableModuleLogic):
     self.timerActive = False
 
     # Recording Data Stream To File/table
-    self.timeStamp = list()
+    self.firstTransform_timeStamps = list()
+    self.secondTransform_timeStamps = list()
+    self.thirdTransform_timeStamps = list()
+    self.firstTransform_matrices = list()
+    self.secondTransform_matrices = list()
+    self.thirdTransform_matrices = list()
+    self.firstTransform_policy.resetPolicy()
+    self.secondTransform_policy.resetPolicy()
+    self.thirdTransform_policy.resetPolicy()
     self.gazePosition3D = list()
     self.gazePosition2D = list()
     self.gazeDirection = list()
@@ -317,76 +411,56 @@ class TransformRecorderLogic(ScriptedLoadableModuleLogic):
 
   def storeData(self):
 
-    # Store time stamp
+    # Time stamp of the current event
     t = self.myTimer.getElapsedTime()
-    self.timeStamp.append(t)
 
     ############## First #############
     if self.firstTransform is not None:
-
-      # Store translation info of transformation matrix
-      self.firstTransform.GetMatrixTransformToParent(self.matrix)
-      self.transform[0,0] = self.matrix.GetElement(0, 0)
-      self.transform[0,1] = self.matrix.GetElement(0, 1)
-      self.transform[0,2] = self.matrix.GetElement(0, 2) 
-      self.transform[0,3] = self.matrix.GetElement(0, 3) 
-      self.transform[1,0] = self.matrix.GetElement(1, 0)
-      self.transform[1,1] = self.matrix.GetElement(1, 1) 
-      self.transform[1,2] = self.matrix.GetElement(1, 2)
-      self.transform[1,3] = self.matrix.GetElement(1, 3)
-      self.transform[2,0] = self.matrix.GetElement(2, 0)  
-      self.transform[2,1] = self.matrix.GetElement(2, 1)
-      self.transform[2,2] = self.matrix.GetElement(2, 2)
-      self.transform[2,3] = self.matrix.GetElement(2, 3)
-      self.transform[3,0] = self.matrix.GetElement(3, 0)  
-      self.transform[3,1] = self.matrix.GetElement(3, 1)
-      self.transform[3,2] = self.matrix.GetElement(3, 2)
-      self.transform[3,3] = self.matrix.GetElement(3, 3)
-      self.firstTransform_matrices.append(self.transform.copy()) 
+      self.storeTransformSample(t, self.firstTransform, self.firstTransform_policy, self.firstTransform_timeStamps, self.firstTransform_matrices)
 
     ############## Second #############
     if self.secondTransform is not None:
+      self.storeTransformSample(t, self.secondTransform, self.secondTransform_policy, self.secondTransform_timeStamps, self.secondTransform_matrices)
 
-      self.secondTransform.GetMatrixTransformToParent(self.matrix)
-      self.transform[0,0] = self.matrix.GetElement(0, 0)
-      self.transform[0,1] = self.matrix.GetElement(0, 1)
-      self.transform[0,2] = self.matrix.GetElement(0, 2) 
-      self.transform[0,3] = self.matrix.GetElement(0, 3) 
-      self.transform[1,0] = self.matrix.GetElement(1, 0)
-      self.transform[1,1] = self.matrix.GetElement(1, 1) 
-      self.transform[1,2] = self.matrix.GetElement(1, 2)
-      self.transform[1,3] = self.matrix.GetElement(1, 3)
-      self.transform[2,0] = self.matrix.GetElement(2, 0)  
-      self.transform[2,1] = self.matrix.GetElement(2, 1)
-      self.transform[2,2] = self.matrix.GetElement(2, 2)
-      self.transform[2,3] = self.matrix.GetElement(2, 3)
-      self.transform[3,0] = self.matrix.GetElement(3, 0)  
-      self.transform[3,1] = self.matrix.GetElement(3, 1)
-      self.transform[3,2] = self.matrix.GetElement(3, 2)
-      self.transform[3,3] = self.matrix.GetElement(3, 3)
-      self.secondTransform_matrices.append(self.transform.copy()) 
-    
     ############## Third #############
     if self.thirdTransform is not None:
+      self.storeTransformSample(t, self.thirdTransform, self.thirdTransform_policy, self.thirdTransform_timeStamps, self.thirdTransform_matrices)
 
-      self.thirdTransform.GetMatrixTransformToParent(self.matrix)
-      self.transform[0,0] = self.matrix.GetElement(0, 0)
-      self.transform[0,1] = self.matrix.GetElement(0, 1)
-      self.transform[0,2] = self.matrix.GetElement(0, 2) 
-      self.transform[0,3] = self.matrix.GetElement(0, 3) 
-      self.transform[1,0] = self.matrix.GetElement(1, 0)
-      self.transform[1,1] = self.matrix.GetElement(1, 1) 
-      self.transform[1,2] = self.matrix.GetElement(1, 2)
-      self.transform[1,3] = self.matrix.GetElement(1, 3)
-      self.transform[2,0] = self.matrix.GetElement(2, 0)  
-      self.transform[2,1] = self.matrix.GetElement(2, 1)
-      self.transform[2,2] = self.matrix.GetElement(2, 2)
-      self.transform[2,3] = self.matrix.GetElement(2, 3)
-      self.transform[3,0] = self.matrix.GetElement(3, 0)  
-      self.transform[3,1] = self.matrix.GetElement(3, 1)
-      self.transform[3,2] = self.matrix.GetElement(3, 2)
-      self.transform[3,3] = self.matrix.GetElement(3, 3)
-      self.thirdTransform_matrices.append(self.transform.copy()) 
+
+  def storeTransformSample(self, timeStamp, transformNode, policy, timeStamps, matrices):
+    """
+    Summary: Append the current matrix of transformNode to the stream lists if its recording policy accepts it.
+    """
+    if not policy.isSampleDue(timeStamp):
+      return
+    self.getTransformMatrix(transformNode)
+    if policy.hasSampleChanged(self.transform):
+      policy.acceptSample(timeStamp, self.transform)
+      timeStamps.append(timeStamp)
+      matrices.append(self.transform.copy())
+
+
+  def getTransformMatrix(self, transformNode):
+    """
+    Summary: Copy the matrix of transformNode into self.transform.
+    """
+    transformNode.GetMatrixTransformToParent(self.matrix)
+    self.transform[0,0] = self.matrix.GetElement(0, 0)
+    self.transform[0,1] = self.matrix.GetElement(0, 1)
+    self.transform[0,2] = self.matrix.GetElement(0, 2)
+    self.transform[0,3] = self.matrix.GetElement(0, 3)
+    self.transform[1,0] = self.matrix.GetElement(1, 0)
+    self.transform[1,1] = self.matrix.GetElement(1, 1)
+    self.transform[1,2] = self.matrix.GetElement(1, 2)
+    self.transform[1,3] = self.matrix.GetElement(1, 3)
+    self.transform[2,0] = self.matrix.GetElement(2, 0)
+    self.transform[2,1] = self.matrix.GetElement(2, 1)
+    self.transform[2,2] = self.matrix.GetElement(2, 2)
+    self.transform[2,3] = self.matrix.GetElement(2, 3)
+    self.transform[3,0] = self.matrix.GetElement(3, 0)
+    self.transform[3,1] = self.matrix.GetElement(3, 1)
+    self.transform[3,2] = self.matrix.GetElement(3, 2)
+    self.transform[3,3] = self.matrix.GetElement(3, 3)
 
   #######################################################################
   ###################### SAVE DATA TO FILE ##############################
@@ -394,170 +468,144 @@ class TransformRecorderLogic(ScriptedLoadableModuleLogic):
 
   def saveDataStreamToMhaFile(self): 
 
+    savedDataPath = slicer.modules.transformrecorder.path.replace("TransformRecorder.py","") + 'SavedData/'
+    dateAndTime = time.strftime("_%Y-%m-%d_%H-%M-%S")
+
     if self.firstTransform is not None:
-    
-      # Create path
-      dateAndTime = time.strftime("_%Y-%m-%d_%H-%M-%S")
-      mhaFilePath = slicer.modules.transformrecorder.path.replace("TransformRecorder.py","") + 'SavedData/' + 'TransformRecorder_1_' + self.firstTransform_name + '_' + dateAndTime + '.mha'
-      
-      # Create File
-      mha_file = open(mhaFilePath, "w")    
-      
-      # Write Header
-      mha_file.write('ObjectType = Image\n')
-      mha_file.write('NDims = 3\n')
-      mha_file.write('BinaryData = True\n')
-      mha_file.write('BinaryDataByteOrderMSB = False\n')
-      mha_file.write('CompressedData = False\n')
-      mha_file.write('TransformMatrix = 1 0 0 0 1 0 0 0 1\n')
-      mha_file.write('Offset = 0 0 0\n')
-      mha_file.write('CenterOfRotation = 0 0 0\n')
-      mha_file.write('AnatomicalOrientation = RAI\n')
-      mha_file.write('ElementSpacing = 1 1 1\n')
-      mha_file.write('CustomFieldNames = DefaultFrameTransformName UltrasoundImageOrientation\n')
-      mha_file.write('CustomFrameFieldNames = ' + self.firstTransform_name + 'Transform Timestamp FrameNumber ' + self.firstTransform_name + 'TransformStatus\n')
-      mha_file.write('DefaultFrameTransformName = ' + self.firstTransform_name + 'Transform\n')
-
-      # Prepare Data
-      timeStamp = numpy.array(self.timeStamp)
-     
-      firstTransform_matrices = numpy.array(self.firstTransform_matrices)
-
-      # Write Data to MHA File
-      frameCounter = 0
-      for i in range(timeStamp.shape[0]):
-        # Convert frame counter to string of length 4
-        numZerosToAdd = 4 - len(str(frameCounter))
-        frameCounter_string = ''
-        for j in range(numZerosToAdd):
-          frameCounter_string = '0' + frameCounter_string
-        frameCounter_string = frameCounter_string + str(frameCounter)
-
-        mha_file.write('Seq_Frame' + frameCounter_string + '_FrameNumber = ' + str(frameCounter) + '\n')
-        mha_file.write('Seq_Frame' + frameCounter_string + '_' + self.firstTransform_name + 'TransformStatus = OK\n')
-        mha_file.write('Seq_Frame' + frameCounter_string + '_' + self.firstTransform_name + 'Transform = ' + str(firstTransform_matrices[i, 0, 0]) + ' ' + str(firstTransform_matrices[i, 0, 1]) + ' ' + str(firstTransform_matrices[i, 0, 2]) + ' ' + str(firstTransform_matrices[i, 0, 3]) + ' ' + str(firstTransform_matrices[i, 1, 0]) + ' ' + str(firstTransform_matrices[i, 1, 1]) + ' ' + str(firstTransform_matrices[i, 1, 2]) + ' ' + str(firstTransform_matrices[i, 1, 3]) + ' ' + str(firstTransform_matrices[i, 2, 0]) + ' ' + str(firstTransform_matrices[i, 2, 1]) + ' ' + str(firstTransform_matrices[i, 2, 2]) + ' ' + str(firstTransform_matrices[i, 2, 3]) + ' ' +'0.0 0.0 0.0 1.0 \n')
-        mha_file.write('Seq_Frame' + frameCounter_string + '_Timestamp = ' + str(timeStamp[i]) + '\n')
-        
-        frameCounter = frameCounter + 1
-                        
-      mha_file.write('UltrasoundImageOrientation = MFA\n')
-      mha_file.write('DimSize = 1 1 500\n')
-      mha_file.write('Kinds = domain domain list\n')
-      mha_file.write('ElementType = MET_UCHAR\n')
-      mha_file.write('ElementDataFile = LOCAL\n')
-      
-      mha_file.close()
+      mhaFilePath = savedDataPath + 'TransformRecorder_1_' + self.firstTransform_name + '_' + dateAndTime + '.mha'
+      self.writeDataStreamToMhaFile(mhaFilePath, self.firstTransform_name, self.firstTransform_timeStamps, self.firstTransform_matrices)
 
     if self.secondTransform is not None:
-    
-      # Create path
-      dateAndTime = time.strftime("_%Y-%m-%d_%H-%M-%S")
-      mhaFilePath = slicer.modules.transformrecorder.path.replace("TransformRecorder.py","") + 'SavedData/' + 'TransformRecorder_2_' + self.secondTransform_name + '_' + dateAndTime + '.mha'
-      
-      # Create File
-      mha_file = open(mhaFilePath, "w")    
-      
-      # Write Header
-      mha_file.write('ObjectType = Image\n')
-      mha_file.write('NDims = 3\n')
-      mha_file.write('BinaryData = True\n')
-      mha_file.write('BinaryDataByteOrderMSB = False\n')
-      mha_file.write('CompressedData = False\n')
-      mha_file.write('TransformMatrix = 1 0 0 0 1 0 0 0 1\n')
-      mha_file.write('Offset = 0 0 0\n')
-      mha_file.write('CenterOfRotation = 0 0 0\n')
-      mha_file.write('AnatomicalOrientation = RAI\n')
-      mha_file.write('ElementSpacing = 1 1 1\n')
-      mha_file.write('CustomFieldNames = DefaultFrameTransformName UltrasoundImageOrientation\n')
-      mha_file.write('CustomFrameFieldNames = ' + self.secondTransform_name + 'Transform Timestamp FrameNumber ' + self.secondTransform_name + 'TransformStatus\n')
-      mha_file.write('DefaultFrameTransformName = ' + self.secondTransform_name + 'Transform\n')
-
-      # Prepare Data
-      timeStamp = numpy.array(self.timeStamp)
-     
-      secondTransform_matrices = numpy.array(self.secondTransform_matrices)
-
-      # Write Data to MHA File
-      frameCounter = 0
-      for i in range(timeStamp.shape[0]):
-        # Convert frame counter to string of length 4
-        numZerosToAdd = 4 - len(str(frameCounter))
-        frameCounter_string = ''
-        for j in range(numZerosToAdd):
-          frameCounter_string = '0' + frameCounter_string
-        frameCounter_string = frameCounter_string + str(frameCounter)
-
-        mha_file.write('Seq_Frame' + frameCounter_string + '_FrameNumber = ' + str(frameCounter) + '\n')
-        mha_file.write('Seq_Frame' + frameCounter_string + '_' + self.secondTransform_name + 'TransformStatus = OK\n')
-        mha_file.write('Seq_Frame' + frameCounter_string + '_' + self.secondTransform_name + 'Transform = ' + str(secondTransform_matrices[i, 0, 0]) + ' ' + str(secondTransform_matrices[i, 0, 1]) + ' ' + str(secondTransform_matrices[i, 0, 2]) + ' ' + str(secondTransform_matrices[i, 0, 3]) + ' ' + str(secondTransform_matrices[i, 1, 0]) + ' ' + str(secondTransform_matrices[i, 1, 1]) + ' ' + str(secondTransform_matrices[i, 1, 2]) + ' ' + str(secondTransform_matrices[i, 1, 3]) + ' ' + str(secondTransform_matrices[i, 2, 0]) + ' ' + str(secondTransform_matrices[i, 2, 1]) + ' ' + str(secondTransform_matrices[i, 2, 2]) + ' ' + str(secondTransform_matrices[i, 2, 3]) + ' ' +'0.0 0.0 0.0 1.0 \n')
-        mha_file.write('Seq_Frame' + frameCounter_string + '_Timestamp = ' + str(timeStamp[i]) + '\n')
-        
-        frameCounter = frameCounter + 1
-                        
-      mha_file.write('UltrasoundImageOrientation = MFA\n')
-      mha_file.write('DimSize = 1 1 500\n')
-      mha_file.write('Kinds = domain domain list\n')
-      mha_file.write('ElementType = MET_UCHAR\n')
-      mha_file.write('ElementDataFile = LOCAL\n')
-      
-      mha_file.close()
+      mhaFilePath = savedDataPath + 'TransformRecorder_2_' + self.secondTransform_name + '_' + dateAndTime + '.mha'
+      self.writeDataStreamToMhaFile(mhaFilePath, self.secondTransform_name, self.secondTransform_timeStamps, self.secondTransform_matrices)
 
     if self.thirdTransform is not None:
+      mhaFilePath = savedDataPath + 'TransformRecorder_3_' + self.thirdTransform_name + '_' + dateAndTime + '.mha'
+      self.writeDataStreamToMhaFile(mhaFilePath, self.thirdTransform_name, self.thirdTransform_timeStamps, self.thirdTransform_matrices)
+
+
+  def writeDataStreamToMhaFile(self, mhaFilePath, transformName, timeStamps, matrices):
+    """
+    Summary: Write one transform stream with its own time stamps to a .mha sequence metafile.
+    """
+    # Create File
+    mha_file = open(mhaFilePath, "w")    
     
-      # Create path
-      dateAndTime = time.strftime("_%Y-%m-%d_%H-%M-%S")
-      mhaFilePath = slicer.modules.transformrecorder.path.replace("TransformRecorder.py","") + 'SavedData/' + 'TransformRecorder_3_' + self.thirdTransform_name + '_' + dateAndTime + '.mha'
-      
-      # Create File
-      mha_file = open(mhaFilePath, "w")    
-      
-      # Write Header
-      mha_file.write('ObjectType = Image\n')
-      mha_file.write('NDims = 3\n')
-      mha_file.write('BinaryData = True\n')
-      mha_file.write('BinaryDataByteOrderMSB = False\n')
-      mha_file.write('CompressedData = False\n')
-      mha_file.write('TransformMatrix = 1 0 0 0 1 0 0 0 1\n')
-      mha_file.write('Offset = 0 0 0\n')
-      mha_file.write('CenterOfRotation = 0 0 0\n')
-      mha_file.write('AnatomicalOrientation = RAI\n')
-      mha_file.write('ElementSpacing = 1 1 1\n')
-      mha_file.write('CustomFieldNames = DefaultFrameTransformName UltrasoundImageOrientation\n')
-      mha_file.write('CustomFrameFieldNames = ' + self.thirdTransform_name + 'Transform Timestamp FrameNumber ' + self.thirdTransform_name + 'TransformStatus\n')
-      mha_file.write('DefaultFrameTransformName = ' + self.thirdTransform_name + 'Transform\n')
-
-      # Prepare Data
-      timeStamp = numpy.array(self.timeStamp)
-     
-      thirdTransform_matrices = numpy.array(self.thirdTransform_matrices)
-
-      # Write Data to MHA File
-      frameCounter = 0
-      for i in range(timeStamp.shape[0]):
-        # Convert frame counter to string of length 4
-        numZerosToAdd = 4 - len(str(frameCounter))
-        frameCounter_string = ''
-        for j in range(numZerosToAdd):
-          frameCounter_string = '0' + frameCounter_string
-        frameCounter_string = frameCounter_string + str(frameCounter)
-
-        mha_file.write('Seq_Frame' + frameCounter_string + '_FrameNumber = ' + str(frameCounter) + '\n')
-        mha_file.write('Seq_Frame' + frameCounter_string + '_' + self.thirdTransform_name + 'TransformStatus = OK\n')
-        mha_file.write('Seq_Frame' + frameCounter_string + '_' + self.thirdTransform_name + 'Transform = ' + str(thirdTransform_matrices[i, 0, 0]) + ' ' + str(thirdTransform_matrices[i, 0, 1]) + ' ' + str(thirdTransform_matrices[i, 0, 2]) + ' ' + str(thirdTransform_matrices[i, 0, 3]) + ' ' + str(thirdTransform_matrices[i, 1, 0]) + ' ' + str(thirdTransform_matrices[i, 1, 1]) + ' ' + str(thirdTransform_matrices[i, 1, 2]) + ' ' + str(thirdTransform_matrices[i, 1, 3]) + ' ' + str(thirdTransform_matrices[i, 2, 0]) + ' ' + str(thirdTransform_matrices[i, 2, 1]) + ' ' + str(thirdTransform_matrices[i, 2, 2]) + ' ' + str(thirdTransform_matrices[i, 2, 3]) + ' ' +'0.0 0.0 0.0 1.0 \n')
-        mha_file.write('Seq_Frame' + frameCounter_string + '_Timestamp = ' + str(timeStamp[i]) + '\n')
-        
-        frameCounter = frameCounter + 1
-                        
-      mha_file.write('UltrasoundImageOrientation = MFA\n')
-      mha_file.write('DimSize = 1 1 500\n')
-      mha_file.write('Kinds = domain domain list\n')
-      mha_file.write('ElementType = MET_UCHAR\n')
-      mha_file.write('ElementDataFile = LOCAL\n')
+    # Write Header
+    mha_file.write('ObjectType = Image\n')
+    mha_file.write('NDims = 3\n')
+    mha_file.write('BinaryData = True\n')
+    mha_file.write('BinaryDataByteOrderMSB = False\n')
+    mha_file.write('CompressedData = False\n')
+    mha_file.write('TransformMatrix = 1 0 0 0 1 0 0 0 1\n')
+    mha_file.write('Offset = 0 0 0\n')
+    mha_file.write('CenterOfRotation = 0 0 0\n')
+    mha_file.write('AnatomicalOrientation = RAI\n')
+    mha_file.write('ElementSpacing = 1 1 1\n')
+    mha_file.write('CustomFieldNames = DefaultFrameTransformName UltrasoundImageOrientation\n')
+    mha_file.write('CustomFrameFieldNames = ' + transformName + 'Transform Timestamp FrameNumber ' + transformName + 'TransformStatus\n')
+    mha_file.write('DefaultFrameTransformName = ' + transformName + 'Transform\n')
+
+    # Prepare Data
+    timeStamps = numpy.array(timeStamps)
+    matrices = numpy.array(matrices)
+
+    # Write Data to MHA File
+    frameCounter = 0
+    for i in range(timeStamps.shape[0]):
+      # Convert frame counter to string of length 4
+      numZerosToAdd = 4 - len(str(frameCounter))
+      frameCounter_string = ''
+      for j in range(numZerosToAdd):
+        frameCounter_string = '0' + frameCounter_string
+      frameCounter_string = frameCounter_string + str(frameCounter)
+
+      mha_file.write('Seq_Frame' + frameCounter_string + '_FrameNumber = ' + str(frameCounter) + '\n')
+      mha_file.write('Seq_Frame' + frameCounter_string + '_' + transformName + 'TransformStatus = OK\n')
+      mha_file.write('Seq_Frame' + frameCounter_string + '_' + transformName + 'Transform = ' + str(matrices[i, 0, 0]) + ' ' + str(matrices[i, 0, 1]) + ' ' + str(matrices[i, 0, 2]) + ' ' + str(matrices[i, 0, 3]) + ' ' + str(matrices[i, 1, 0]) + ' ' + str(matrices[i, 1, 1]) + ' ' + str(matrices[i, 1, 2]) + ' ' + str(matrices[i, 1, 3]) + ' ' + str(matrices[i, 2, 0]) + ' ' + str(matrices[i, 2, 1]) + ' ' + str(matrices[i, 2, 2]) + ' ' + str(matrices[i, 2, 3]) + ' ' +'0.0 0.0 0.0 1.0 \n')
+      mha_file.write('Seq_Frame' + frameCounter_string + '_Timestamp = ' + str(timeStamps[i]) + '\n')
       
-      mha_file.close()
+      frameCounter = frameCounter + 1
+                      
+    mha_file.write('UltrasoundImageOrientation = MFA\n')
+    mha_file.write('DimSize = 1 1 ' + str(frameCounter) + '\n')
+    mha_file.write('Kinds = domain domain list\n')
+    mha_file.write('ElementType = MET_UCHAR\n')
+    mha_file.write('ElementDataFile = LOCAL\n')
+    
+    mha_file.close()
 
 
-    
+  def readDataStreamFromMhaFile(self, mhaFilePath):
+    """
+    Summary: Read the time stamps and matrices of the transform stream stored in a .mha sequence metafile.
+    The number of frames is taken from the file, so streams recorded at different rates can be read back.
+    The stream is DefaultFrameTransformName or, if missing, the first Seq_Frame*_*Transform field.
+    Only the header is parsed; any image data after ElementDataFile is ignored.
+    """
+    transformName = None
+    frameFields = dict()
+
+    # Read in binary mode so that image data after the header cannot break the decoding
+    with open(mhaFilePath, "rb") as mha_file:
+      for line in mha_file:
+        line = line.decode('latin-1').strip()
+        if ' = ' not in line:
+          continue
+        key, value = line.split(' = ', 1)
+        if key == 'ElementDataFile':
+          break
+        elif key == 'DefaultFrameTransformName':
+          transformName = value
+        elif key.startswith('Seq_Frame') and '_' in key:
+          frameNumber, fieldName = key[len('Seq_Frame'):].split('_', 1)
+          frameFields.setdefault(int(frameNumber), dict())[fieldName] = value
+
+    if transformName is None:
+      for frameNumber in sorted(frameFields.keys()):
+        for fieldName in sorted(frameFields[frameNumber].keys()):
+          if fieldName.endswith('Transform'):
+            transformName = fieldName
+            break
+        if transformName is not None:
+          break
+      if transformName is None:
+        logging.warning('No transform found in ' + mhaFilePath)
+      else:
+        logging.warning('No DefaultFrameTransformName found in ' + mhaFilePath + ', reading ' + transformName)
+
+    frameTimeStamps = dict()
+    frameMatrices = dict()
+    frameStatus = dict()
+    if transformName is not None:
+      for frameNumber in frameFields.keys():
+        fields = frameFields[frameNumber]
+        if 'Timestamp' in fields:
+          frameTimeStamps[frameNumber] = float(fields['Timestamp'])
+        if transformName in fields:
+          frameMatrices[frameNumber] = numpy.array(fields[transformName].split(), dtype=numpy.float64).reshape(4, 4)
+        if transformName + 'Status' in fields:
+          frameStatus[frameNumber] = fields[transformName + 'Status']
+
+    # Keep only valid frames with a time stamp
+    frameNumbers = list()
+    for frameNumber in sorted(frameMatrices.keys()):
+      if frameStatus.get(frameNumber, 'OK') != 'OK':
+        continue
+      if frameNumber not in frameTimeStamps:
+        logging.warning('Frame ' + str(frameNumber) + ' has no time stamp in ' + mhaFilePath)
+        continue
+      frameNumbers.append(frameNumber)
+
+    if len(frameNumbers) == 0:
+      logging.warning('No valid frames found in ' + mhaFilePath)
+
+    timeStamps = numpy.array([frameTimeStamps[frameNumber] for frameNumber in frameNumbers])
+    matrices = numpy.zeros((len(frameNumbers), 4, 4), dtype=numpy.float64)
+    for i in range(len(frameNumbers)):
+      matrices[i] = frameMatrices[frameNumbers[i]]
+
+    return timeStamps, matrices
 
 
 class TransformRecorderTest(ScriptedLoadableModuleTest):
@@ -577,6 +625,8 @@ class TransformRecorderTest(ScriptedLoadableModuleTest):
     """
     self.setUp()
     self.test_TransformRecorder1()
+    self.setUp()
+    self.test_TransformRecorderPolicy()
 
   def test_TransformRecorder1(self):
     """ Ideally you should have several levels of tests.  At the lowest level
@@ -614,25 +664,101 @@ class TransformRecorderTest(ScriptedLoadableModuleTest):
     self.assertIsNotNone( logic.hasImageData(volumeNode) )
     self.delayDisplay('Test passed!')
 
+  def test_TransformRecorderPolicy(self):
+    """ Check that storeData applies the recording policy of each transform, so that a
+    moving and a mostly static transform end up with different frame counts, and that
+    these streams are written and read back with their own time stamps.
+    """
+
+    self.delayDisplay("Starting the recording policy test")
+
+    class SteppedTimer(Timer):
+      def __init__(self):
+        Timer.__init__(self)
+        self.elapsedTime = 0.0
+      def getElapsedTime(self):
+        return self.elapsedTime
+
+    movingNode = slicer.vtkMRMLLinearTransformNode()
+    movingNode.SetName('Moving')
+    slicer.mrmlScene.AddNode(movingNode)
+    staticNode = slicer.vtkMRMLLinearTransformNode()
+    staticNode.SetName('Static')
+    slicer.mrmlScene.AddNode(staticNode)
+
+    logic = TransformRecorderLogic()
+    logic.myTimer = SteppedTimer()
+    logic.setFirstTransform(movingNode)
+    logic.setSecondTransform(staticNode)
+    logic.firstTransform_policy.decimation = 2
+    logic.secondTransform_policy.maxRate = 10.0
+    logic.secondTransform_policy.translationThreshold = 0.5
+    logic.secondTransform_policy.rotationThreshold = 1.0
+
+    # 1 second of events at 200 Hz. The moving transform translates 1 mm per event,
+    # the static one is rotated once by 20 degrees (no translation) after 0.5 s.
+    movingMatrix = vtk.vtkMatrix4x4()
+    rotatedTransform = vtk.vtkTransform()
+    rotatedTransform.RotateZ(20.0)
+    for i in range(200):
+      logic.myTimer.elapsedTime = i * 0.005
+      movingMatrix.SetElement(0, 3, i * 1.0)
+      movingNode.SetMatrixTransformToParent(movingMatrix)
+      if i == 100:
+        staticNode.SetMatrixTransformToParent(rotatedTransform.GetMatrix())
+      logic.storeData()
+
+    expectedMovingTimeStamps = [i * 0.005 for i in range(0, 200, 2)]
+    self.assertEqual(len(logic.firstTransform_matrices), 100)
+    self.assertTrue(numpy.allclose(logic.firstTransform_timeStamps, expectedMovingTimeStamps))
+    self.assertEqual(len(logic.secondTransform_matrices), 2)
+    self.assertTrue(numpy.allclose(logic.secondTransform_timeStamps, [0.0, 0.5]))
+
+    # Write and read back streams with different frame counts
+    movingFilePath = os.path.join(slicer.app.temporaryPath, 'TransformRecorderTest_Moving.mha')
+    staticFilePath = os.path.join(slicer.app.temporaryPath, 'TransformRecorderTest_Static.mha')
+    try:
+      logic.writeDataStreamToMhaFile(movingFilePath, 'Moving', logic.firstTransform_timeStamps, logic.firstTransform_matrices)
+      logic.writeDataStreamToMhaFile(staticFilePath, 'Static', logic.secondTransform_timeStamps, logic.secondTransform_matrices)
+
+      timeStamps, matrices = logic.readDataStreamFromMhaFile(movingFilePath)
+      self.assertEqual(matrices.shape, (100, 4, 4))
+      self.assertTrue(numpy.allclose(timeStamps, expectedMovingTimeStamps))
+      self.assertTrue(numpy.allclose(matrices, logic.firstTransform_matrices))
+
+      timeStamps, matrices = logic.readDataStreamFromMhaFile(staticFilePath)
+      self.assertEqual(matrices.shape, (2, 4, 4))
+      self.assertTrue(numpy.allclose(timeStamps, [0.0, 0.5]))
+      self.assertTrue(numpy.allclose(matrices, logic.secondTransform_matrices))
+    finally:
+      for filePath in (movingFilePath, staticFilePath):
+        if os.path.exists(filePath):
+          os.remove(filePath)
+
+    self.delayDisplay('Test passed!')
+
 class Timer(object):
 
   def __init__(self):
     self.startTime = 0.0
     self.stopTime = 0.0
+    self.pausedDuration = 0.0
     self.timerStarted = False
     
   def startTimer(self):
     if not self.timerStarted:      
-      self.startTime = time.clock()
-      if self.stopTime != 0.0:
-        self.stopTime = time.clock() - self.stopTime
+      if self.startTime == 0.0:
+        self.startTime = time.time()
+      elif self.stopTime != 0.0:
+        self.pausedDuration = self.pausedDuration + time.time() - self.stopTime
+      self.stopTime = 0.0
       self.timerStarted = True
     else:
       logging.warning('Timer already running')
       
   def stopTimer(self):
     if self.timerStarted:
-      self.stopTime = time.clock()
+      self.stopTime = time.time()
       self.timerStarted = False
     else:
       logging.warning('Timer not running')
@@ -640,12 +766,58 @@ class Timer(object):
   def getElapsedTime(self):
     if self.startTime == 0.0:
       return 0.0
-    elif self.stopTime == 0.0:
-      return time.clock() - self.startTime
+    elif self.timerStarted:
+      return time.time() - self.startTime - self.pausedDuration
     else:
-      return time.clock() - (self.stopTime - self.startTime)
+      return self.stopTime - self.startTime - self.pausedDuration
         
   def resetTimer(self):
-    if self.startTime != 0.0:
-      self.startTime = time.clock()    
-      self.stopTime = 0.0
+    if self.timerStarted:
+      self.startTime = time.time()
+    else:
+      self.startTime = 0.0
+    self.stopTime = 0.0
+    self.pausedDuration = 0.0
+
+class RecordingPolicy(object):
+
+  def __init__(self):
+    self.maxRate = 0.0 # Maximum recording rate in Hz. 0 means no limit.
+    self.decimation = 1 # Record one of every N events.
+    self.translationThreshold = 0.0 # Record if the translation changed more than this (mm). 0 ignores translation.
+    self.rotationThreshold = 0.0 # Record if the rotation changed more than this (degrees). 0 ignores rotation.
+    self.resetPolicy()
+
+  def resetPolicy(self):
+    self.eventCounter = 0
+    self.lastTimeStamp = None
+    self.lastMatrix = None
+
+  def isSampleDue(self, timeStamp):
+    self.eventCounter = self.eventCounter + 1
+    if self.decimation > 1 and (self.eventCounter - 1) % self.decimation != 0:
+      return False
+    if self.maxRate > 0.0 and self.lastTimeStamp is not None and (timeStamp - self.lastTimeStamp) < 1.0 / self.maxRate - 1e-9:
+      return False
+    return True
+
+  def hasSampleChanged(self, matrix):
+    # If both thresholds are 0 every sample is recorded. Otherwise the sample is recorded if either
+    # the translation or the rotation change exceeds its threshold. A 0 threshold ignores that component.
+    if self.lastMatrix is None or (self.translationThreshold <= 0.0 and self.rotationThreshold <= 0.0):
+      return True
+    if self.translationThreshold > 0.0:
+      translationChange = numpy.linalg.norm(matrix[0:3,3] - self.lastMatrix[0:3,3])
+      if translationChange > self.translationThreshold:
+        return True
+    if self.rotationThreshold > 0.0:
+      relativeRotation = numpy.dot(self.lastMatrix[0:3,0:3].T, matrix[0:3,0:3])
+      cosAngle = numpy.clip((numpy.trace(relativeRotation) - 1.0) / 2.0, -1.0, 1.0)
+      rotationChange = numpy.degrees(numpy.arccos(cosAngle))
+      if rotationChange > self.rotationThreshold:
+        return True
+    return False
+
+  def acceptSample(self, timeStamp, matrix):
+    self.lastTimeStamp = timeStamp
+    self.lastMatrix = matrix.copy()